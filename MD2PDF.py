@@ -1,15 +1,47 @@
 import os
+import json
+import hashlib
 import markdown
-import pdfkit
 import argparse
 from pathlib import Path
 import logging
 from datetime import datetime
 import sys
 import re
-from bs4 import BeautifulSoup
+import shutil
+import functools
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import emoji
 
+# 输出目录中记录已生成PDF对应内容摘要的文件
+CACHE_FILE_NAME = '.md2pdf_cache.json'
+
+# wkhtmltopdf 命令行参数
+WKHTMLTOPDF_OPTIONS = (
+    '--page-size', 'A4',
+    '--margin-top', '1in',
+    '--margin-right', '1in',
+    '--margin-bottom', '1in',
+    '--margin-left', '1in',
+    '--encoding', 'UTF-8',
+    '--quiet',
+    '--enable-local-file-access',
+    '--dpi', '300',
+    '--image-quality', '100',
+)
+
+# Markdown渲染器，启用代码块扩展；每个进程只初始化一次，逐个文件复用
+MARKDOWN = markdown.Markdown(extensions=['fenced_code', 'codehilite'])
+
+# 字体名称末尾的字重和样式
+FONT_SUFFIX_RE = re.compile(r'(?:\s+(?:normal|italic|bold|regular|light|medium|heavy|black))+$', re.IGNORECASE)
+
+# 辅助平面字符（emoji等）及HTML标签
+EMOJI_RE = re.compile('[\U00010000-\U0010FFFF]+')
+TAG_RE = re.compile(r'(<[^>]+>)')
+
 def setup_logging():
     """设置日志记录"""
     log_dir = Path('logs')
@@ -29,19 +61,20 @@ def setup_logging():
     
     return log_file
 
+@functools.lru_cache(maxsize=256)
 def clean_font_name(font_name):
     """清理字体名称，移除字重和样式信息"""
-    suffixes = [' normal', ' normal italic', ' italic', ' bold', ' bold italic', 
-                ' regular', ' light', ' medium', ' heavy', ' black',
-                ' Normal', ' Normal Italic', ' Italic', ' Bold', ' Bold Italic',
-                ' Regular', ' Light', ' Medium', ' Heavy', ' Black']
-    
-    cleaned = font_name
-    for suffix in suffixes:
-        if cleaned.lower().endswith(suffix.lower()):
-            cleaned = cleaned[:-len(suffix)]
-    
-    return cleaned.strip()
+    return FONT_SUFFIX_RE.sub('', font_name).strip()
+
+@functools.lru_cache(maxsize=None)
+def list_font_files(fonts_dir):
+    """列出字体目录中的字体文件，.ttf优先于.otf，结果会被缓存"""
+    font_files = [
+        Path(entry.path) for entry in os.scandir(fonts_dir)
+        if entry.is_file() and entry.name.lower().endswith(('.ttf', '.otf'))
+    ]
+    font_files.sort(key=lambda font_file: font_file.suffix.lower() != '.ttf')
+    return font_files
 
 def get_font_file_path(fonts_dir, font_name):
     """根据字体名称查找对应的字体文件"""
@@ -60,188 +93,289 @@ def get_font_file_path(fonts_dir, font_name):
                 if font_path.exists():
                     return font_path
     
-    for ext in ['.ttf', '.otf']:
-        for font_file in fonts_dir.glob(f'*{ext}'):
-            if font_name_lower in font_file.stem.lower():
-                return font_file
+    for font_file in list_font_files(fonts_dir):
+        if font_name_lower in font_file.stem.lower():
+            return font_file
     
     return None
 
+def _wrap_emoji(match):
+    """将连续的emoji包裹在span中，样式由样式表中的 .emoji 提供"""
+    return '<span class="emoji">' + match.group(0) + '</span>'
+
 def process_emoji_content(html_content):
     """处理HTML中的emoji"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    for text_node in soup.find_all(string=True):
-        if any(ord(char) > 0xFFFF for char in text_node):
-            new_content = []
-            for char in text_node:
-                if ord(char) > 0xFFFF:
-                    span = soup.new_tag('span', **{
-                        'class': 'emoji',
-                        'style': 'font-family: "Apple Color Emoji", "Segoe UI Emoji", "Segoe UI Symbol", "Noto Color Emoji"; font-size: 1.2em;'
-                    })
-                    span.string = char
-                    new_content.append(span)
-                else:
-                    new_content.append(char)
-            
-            text_node.replace_with(*new_content)
+    # 只有辅助平面字符在UTF-16中占两个码元，长度不变说明没有emoji，直接返回
+    if len(html_content.encode('utf-16-le')) == 2 * len(html_content):
+        return html_content
+    
+    parts = TAG_RE.split(html_content)
+    
+    # 奇数下标为标签，只替换标签之间的文本
+    for i in range(0, len(parts), 2):
+        parts[i] = EMOJI_RE.sub(_wrap_emoji, parts[i])
     
-    return str(soup)
+    return ''.join(parts)
 
-def convert_md_to_pdf(md_file, pdf_file, font_config=None, custom_fonts_dir=None):
+def build_css_style(font_config, custom_fonts_dir=None):
     """
-    将Markdown文件转换为PDF，支持自定义字体
+    构建PDF样式表，所有文件共用，只需在启动时生成一次
     """
-    try:
-        with open(md_file, 'r', encoding='utf-8') as f:
-            md_content = f.read()
-
-        # 启用代码块扩展
-        extensions = ['fenced_code', 'codehilite']
-        html_content = markdown.markdown(md_content, extensions=extensions)
-        html_content = process_emoji_content(html_content)
-
-        # 清理字体名称
-        cleaned_font_config = {}
-        for key, value in font_config.items():
-            cleaned_value = value.replace("'", "").replace('"', '')
-            cleaned_value = clean_font_name(cleaned_value)
-            cleaned_font_config[key] = f"'{cleaned_value}'"
-        
-        # 构建字体CSS
-        font_css = ""
-        if custom_fonts_dir:
-            fonts_dir_path = Path(custom_fonts_dir)
-            
-            miaowu_font_path = get_font_file_path(fonts_dir_path, '方正喵呜体')
-            if miaowu_font_path:
-                font_url = miaowu_font_path.as_uri()
-                font_css += f"""
-                @font-face {{
-                    font-family: '方正喵呜体';
-                    src: url('{font_url}');
-                    font-weight: normal;
-                    font-style: normal;
-                }}
-                """
-                logging.info(f"找到方正喵呜体字体文件: {miaowu_font_path}")
-            
-            maple_font_path = get_font_file_path(fonts_dir_path, 'Maple Mono CN')
-            if maple_font_path:
-                font_url = maple_font_path.as_uri()
-                font_css += f"""
-                @font-face {{
-                    font-family: 'Maple Mono CN';
-                    src: url('{font_url}');
-                    font-weight: normal;
-                    font-style: normal;
-                }}
-                """
-                logging.info(f"找到Maple Mono CN字体文件: {maple_font_path}")
-        
-        # CSS样式
-        css_style = f"""
-        {font_css}
-        
-        @page {{
-            size: A4;
-            margin: 1in;
-        }}
-        
-        body {{
-            font-family: {cleaned_font_config.get('body', "'方正喵呜体', 'Microsoft YaHei', sans-serif")};
-            line-height: 1.8;
-            color: #333;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 40px;
-            font-size: 14px;
-        }}
-        
-        h1, h2, h3, h4, h5, h6 {{
-            font-family: {cleaned_font_config.get('heading', "'方正喵呜体', 'Microsoft YaHei', sans-serif")};
-            color: #2c3e50;
-            font-weight: bold;
-            margin-top: 1.5em;
-            margin-bottom: 0.8em;
-            line-height: 1.3;
-        }}
-        
-        h1 {{ font-size: 2.2em; border-bottom: 3px solid #3498db; padding-bottom: 0.3em; }}
-        h2 {{ font-size: 1.8em; border-bottom: 2px solid #3498db; padding-bottom: 0.2em; }}
-        h3 {{ font-size: 1.5em; }}
-        h4 {{ font-size: 1.3em; color: #e74c3c; }}
-        h5 {{ font-size: 1.1em; color: #9b59b6; }}
-        h6 {{ font-size: 1em; color: #f39c12; text-transform: uppercase; letter-spacing: 1px; }}
+    # 清理字体名称
+    cleaned_font_config = {}
+    for key, value in font_config.items():
+        cleaned_value = value.replace("'", "").replace('"', '')
+        cleaned_value = clean_font_name(cleaned_value)
+        cleaned_font_config[key] = f"'{cleaned_value}'"
+    
+    # 构建字体CSS
+    font_css = ""
+    if custom_fonts_dir:
+        fonts_dir_path = Path(custom_fonts_dir)
         
-        code {{
-            font-family: {cleaned_font_config.get('code', "'Maple Mono CN', 'Courier New', monospace")};
-            background-color: #f8f9fa;
-            padding: 2px 6px;
-            border-radius: 4px;
-            border: 1px solid #e9ecef;
-            font-size: 0.9em;
-        }}
+        miaowu_font_path = get_font_file_path(fonts_dir_path, '方正喵呜体')
+        if miaowu_font_path:
+            font_url = miaowu_font_path.resolve().as_uri()
+            font_css += f"""
+            @font-face {{
+                font-family: '方正喵呜体';
+                src: url('{font_url}');
+                font-weight: normal;
+                font-style: normal;
+            }}
+            """
+            logging.info(f"找到方正喵呜体字体文件: {miaowu_font_path}")
         
-        pre {{
-            font-family: {cleaned_font_config.get('code', "'Maple Mono CN', 'Courier New', monospace")};
-            background-color: #f8f9fa;
-            padding: 20px;
-            border-radius: 8px;
-            overflow: auto;
-            border: 1px solid #e9ecef;
-            line-height: 1.5;
-            font-size: 0.9em;
-        }}
+        maple_font_path = get_font_file_path(fonts_dir_path, 'Maple Mono CN')
+        if maple_font_path:
+            font_url = maple_font_path.resolve().as_uri()
+            font_css += f"""
+            @font-face {{
+                font-family: 'Maple Mono CN';
+                src: url('{font_url}');
+                font-weight: normal;
+                font-style: normal;
+            }}
+            """
+            logging.info(f"找到Maple Mono CN字体文件: {maple_font_path}")
+    
+    # CSS样式
+    css_style = f"""
+    {font_css}
+    
+    @page {{
+        size: A4;
+        margin: 1in;
+    }}
+    
+    body {{
+        font-family: {cleaned_font_config.get('body', "'方正喵呜体', 'Microsoft YaHei', sans-serif")};
+        line-height: 1.8;
+        color: #333;
+        max-width: 800px;
+        margin: 0 auto;
+        padding: 40px;
+        font-size: 14px;
+    }}
+    
+    h1, h2, h3, h4, h5, h6 {{
+        font-family: {cleaned_font_config.get('heading', "'方正喵呜体', 'Microsoft YaHei', sans-serif")};
+        color: #2c3e50;
+        font-weight: bold;
+        margin-top: 1.5em;
+        margin-bottom: 0.8em;
+        line-height: 1.3;
+    }}
+    
+    h1 {{ font-size: 2.2em; border-bottom: 3px solid #3498db; padding-bottom: 0.3em; }}
+    h2 {{ font-size: 1.8em; border-bottom: 2px solid #3498db; padding-bottom: 0.2em; }}
+    h3 {{ font-size: 1.5em; }}
+    h4 {{ font-size: 1.3em; color: #e74c3c; }}
+    h5 {{ font-size: 1.1em; color: #9b59b6; }}
+    h6 {{ font-size: 1em; color: #f39c12; text-transform: uppercase; letter-spacing: 1px; }}
+    
+    code {{
+        font-family: {cleaned_font_config.get('code', "'Maple Mono CN', 'Courier New', monospace")};
+        background-color: #f8f9fa;
+        padding: 2px 6px;
+        border-radius: 4px;
+        border: 1px solid #e9ecef;
+        font-size: 0.9em;
+    }}
+    
+    pre {{
+        font-family: {cleaned_font_config.get('code', "'Maple Mono CN', 'Courier New', monospace")};
+        background-color: #f8f9fa;
+        padding: 20px;
+        border-radius: 8px;
+        overflow: auto;
+        border: 1px solid #e9ecef;
+        line-height: 1.5;
+        font-size: 0.9em;
+    }}
+    
+    pre code {{
+        background: none;
+        padding: 0;
+        border: none;
+        border-radius: 0;
+    }}
+    
+    .emoji {{
+        font-family: "Apple Color Emoji", "Segoe UI Emoji", "Segoe UI Symbol", "Noto Color Emoji", sans-serif !important;
+        font-size: 1.2em;
+    }}
+    """
+    
+    return css_style
+
+def render_html(md_file, css_style):
+    """
+    将Markdown文件渲染为完整的HTML文档
+    """
+    with open(md_file, 'r', encoding='utf-8') as f:
+        md_content = f.read()
+
+    html_content = MARKDOWN.reset().convert(md_content)
+    html_content = process_emoji_content(html_content)
+    
+    full_html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>{Path(md_file).stem}</title>
+        <style>
+            {css_style}
+        </style>
+    </head>
+    <body>
+        {html_content}
+    </body>
+    </html>
+    """
+    
+    return full_html
+
+def quote_arg(path):
+    """为 --read-args-from-stdin 的参数行加引号"""
+    text = Path(path).as_posix()
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def wkhtmltopdf_error(stderr, returncode):
+    """从wkhtmltopdf的输出中提取错误信息"""
+    return stderr.decode('utf-8', errors='replace').strip() or f"wkhtmltopdf退出码: {returncode}"
+
+def convert_md_to_pdf(md_file, pdf_file, css_style, wkhtmltopdf='wkhtmltopdf'):
+    """
+    转换单个Markdown文件，HTML和PDF都通过管道传输，不产生临时文件
+    """
+    try:
+        full_html = render_html(md_file, css_style)
+        proc = subprocess.run(
+            [wkhtmltopdf, *WKHTMLTOPDF_OPTIONS, '-', '-'],
+            input=full_html.encode('utf-8'),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if not proc.stdout:
+            return False, wkhtmltopdf_error(proc.stderr, proc.returncode)
         
-        pre code {{
-            background: none;
-            padding: 0;
-            border: none;
-            border-radius: 0;
-        }}
+        with open(pdf_file, 'wb') as f:
+            f.write(proc.stdout)
+        return True, None
         
-        .emoji {{
-            font-family: "Apple Color Emoji", "Segoe UI Emoji", "Segoe UI Symbol", "Noto Color Emoji", sans-serif !important;
-            font-size: 1.2em;
-        }}
-        """
+    except Exception as e:
+        return False, str(e)
+
+def convert_md_batch(jobs, css_style, wkhtmltopdf='wkhtmltopdf'):
+    """
+    将一批Markdown文件转换为PDF，整批共用一个wkhtmltopdf进程
+    """
+    if len(jobs) == 1:
+        md_file, pdf_file = jobs[0]
+        return [(md_file, pdf_file, *convert_md_to_pdf(md_file, pdf_file, css_style, wkhtmltopdf))]
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        stderr_file = tmp_dir / 'stderr.log'
         
-        full_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>{md_file.stem}</title>
-            <style>
-                {css_style}
-            </style>
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
+        try:
+            with open(stderr_file, 'wb') as stderr:
+                proc = subprocess.Popen(
+                    [wkhtmltopdf, *WKHTMLTOPDF_OPTIONS, '--read-args-from-stdin'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr
+                )
+        except OSError as e:
+            return [(md_file, pdf_file, False, str(e)) for md_file, pdf_file in jobs]
         
-        options = {
-            'page-size': 'A4',
-            'margin-top': '1in',
-            'margin-right': '1in',
-            'margin-bottom': '1in',
-            'margin-left': '1in',
-            'encoding': 'UTF-8',
-            'quiet': '',
-            'enable-local-file-access': '',
-            'dpi': 300,
-            'image-quality': 100
-        }
+        # 边渲染边提交：wkhtmltopdf转换当前文件的同时渲染下一个文件
+        queued = []
+        broken_pipe = False
+        for index, (md_file, pdf_file) in enumerate(jobs):
+            # 先输出到临时目录，成功后再移动到目标位置
+            html_file = tmp_dir / f'{index}.html'
+            tmp_pdf = tmp_dir / f'{index}.pdf'
+            queued.append((md_file, pdf_file, tmp_pdf))
+            if broken_pipe:
+                continue
+            
+            try:
+                html_file.write_text(render_html(md_file, css_style), encoding='utf-8')
+            except Exception as e:
+                queued.pop()
+                results.append((md_file, pdf_file, False, str(e)))
+                continue
+            
+            try:
+                proc.stdin.write(f"{quote_arg(html_file)} {quote_arg(tmp_pdf)}\n".encode('utf-8'))
+                proc.stdin.flush()
+            except OSError:
+                # wkhtmltopdf已提前退出，剩余文件不再渲染
+                broken_pipe = True
         
-        pdfkit.from_string(full_html, str(pdf_file), options=options)
-        return True, None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        proc.wait()
+        error = wkhtmltopdf_error(stderr_file.read_bytes(), proc.returncode)
         
-    except Exception as e:
-        return False, str(e)
+        for md_file, pdf_file, tmp_pdf in queued:
+            if tmp_pdf.exists():
+                shutil.move(str(tmp_pdf), pdf_file)
+                results.append((md_file, pdf_file, True, None))
+            else:
+                results.append((md_file, pdf_file, False, error))
+    
+    return results
+
+def content_digest(md_file, css_style):
+    """计算Markdown内容和样式表的摘要；导出工具会把文件时间设为对话创建时间，不能用修改时间判断"""
+    digest = hashlib.sha1(css_style.encode('utf-8'))
+    with open(md_file, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+def load_cache(cache_file):
+    """读取已生成PDF的内容摘要，文件不存在或损坏时返回空字典"""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def save_cache(cache_file, cache):
+    """保存已生成PDF的内容摘要"""
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2, sort_keys=True)
+    except OSError as e:
+        logging.warning(f"无法保存缓存文件 {cache_file}: {e}")
 
 def main():
     parser = argparse.ArgumentParser(description='将Markdown文件转换为PDF，支持自定义字体')
@@ -261,6 +395,12 @@ def main():
                        help='wkhtmltopdf可执行文件路径')
     parser.add_argument('--no-custom-fonts', action='store_true',
                        help='不使用自定义字体，仅使用系统字体')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='并行转换的进程数 (默认: CPU核心数，Windows上最多61)')
+    parser.add_argument('--force', action='store_true',
+                       help='重新生成所有PDF，不跳过已是最新的文件')
+    parser.add_argument('--batch-size', type=int, default=8,
+                       help='每个wkhtmltopdf进程最多转换的文件数 (默认: 8)')
     
     args = parser.parse_args()
     
@@ -289,33 +429,71 @@ def main():
     output_dir = Path(args.output_dir)
     output_dir.mkdir(exist_ok=True)
     
-    md_files = list(input_dir.glob('**/*.md'))
+    md_files = sorted(
+        Path(root) / name
+        for root, _, names in os.walk(input_dir)
+        for name in names if name.endswith('.md')
+    )
     if not md_files:
         logging.warning("未找到Markdown文件")
         return
     
-    success_count = 0
-    for i, md_file in enumerate(md_files, 1):
+    css_style = build_css_style(font_config, fonts_dir_path if custom_fonts_available else None)
+    
+    # 上次生成时的内容摘要，内容和样式都未变且PDF仍存在时无需重新生成
+    cache_file = output_dir / CACHE_FILE_NAME
+    cache = load_cache(cache_file)
+    
+    # 串行创建输出目录，避免子进程之间的竞争
+    jobs = []
+    job_digests = {}
+    skipped_count = 0
+    for md_file in md_files:
         relative_path = md_file.relative_to(input_dir)
         pdf_path = output_dir / relative_path.with_suffix('.pdf')
-        pdf_path.parent.mkdir(exist_ok=True)
+        cache_key = relative_path.as_posix()
+        digest = content_digest(md_file, css_style)
         
-        logging.info(f"处理 [{i}/{len(md_files)}]: {md_file.name}")
+        if not args.force and cache.get(cache_key) == digest and pdf_path.exists():
+            logging.info(f"跳过 (已是最新): {md_file.name}")
+            skipped_count += 1
+            continue
         
-        success, error = convert_md_to_pdf(
-            md_file, 
-            pdf_path, 
-            font_config, 
-            str(fonts_dir_path) if custom_fonts_available else None
-        )
-        
-        if success:
-            logging.info(f"保存成功: {pdf_path.name}")
-            success_count += 1
-        else:
-            logging.error(f"失败: {error}")
+        pdf_path.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append((str(md_file), str(pdf_path)))
+        job_digests[str(md_file)] = (cache_key, digest)
+    
+    wkhtmltopdf = args.wkhtmltopdf_path or 'wkhtmltopdf'
+    
+    success_count = 0
+    done_count = 0
+    # 未指定进程数时由进程池自行决定（Windows上不能超过61）
+    max_workers = max(1, args.workers) if args.workers is not None else None
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # 按批次分发，每批只启动一次wkhtmltopdf；文件较少时缩小批次以保证并行度
+        workers = executor._max_workers
+        batch_size = max(1, min(args.batch_size, -(-len(jobs) // workers)))
+        batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+        futures = [
+            executor.submit(convert_md_batch, batch, css_style, wkhtmltopdf)
+            for batch in batches
+        ]
+        for future in as_completed(futures):
+            for md, pdf, success, error in future.result():
+                done_count += 1
+                logging.info(f"处理 [{done_count}/{len(jobs)}]: {Path(md).name}")
+                
+                cache_key, digest = job_digests[md]
+                if success:
+                    logging.info(f"保存成功: {Path(pdf).name}")
+                    success_count += 1
+                    cache[cache_key] = digest
+                else:
+                    logging.error(f"失败: {error}")
+                    cache.pop(cache_key, None)
     
-    logging.info(f"处理完成! 成功: {success_count}/{len(md_files)}")
+    save_cache(cache_file, cache)
+    logging.info(f"处理完成! 成功: {success_count}/{len(jobs)}, 跳过: {skipped_count}")
 
 if __name__ == "__main__":
     main()
@@ -10,6 +10,28 @@ import logging
 from datetime import datetime
 import re
 
+# 可选依赖：ijson 用于流式解析超大的导出文件，orjson 用于快速整体解析
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 消息角色显示名称
+ROLE_DISPLAY = {
+    'user': '👤 用户',
+    'assistant': '🤖 ChatGPT',
+    'system': '⚙️ 系统',
+    'unknown': '❓ 未知'
+}
+
+# 文件名非法字符、控制字符和换行符
+INVALID_FILENAME_RE = re.compile(r'[<>:"/\\|?*\x00-\x1F\x7F]')
+
 def setup_logging(log_file='chatgpt_conversion_log.txt'):
     """设置日志配置"""
     logging.basicConfig(
@@ -29,10 +51,8 @@ def sanitize_filename(title):
     if not title or not isinstance(title, str):
         return "untitled_chat"
     
-    # 移除非法字符
-    title = re.sub(r'[<>:"/\\|?*]', '', title)
-    # 移除控制字符和换行符
-    title = re.sub(r'[\x00-\x1F\x7F\n\r\t]', '', title)
+    # 移除非法字符、控制字符和换行符
+    title = INVALID_FILENAME_RE.sub('', title)
     # 移除首尾空格和点号
     title = title.strip().strip('.')
     # 限制长度
@@ -44,6 +64,29 @@ def sanitize_filename(title):
     
     return title
 
+def load_json(raw):
+    """一次性解析ChatGPT导出文件；orjson拒绝含孤立代理项（如被截断的emoji）的会话时改用json重试"""
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+def iter_conversations(input_file):
+    """
+    逐个读取会话，安装了带C扩展后端的ijson时流式解析，无需将整个文件载入内存；
+    ijson的纯Python后端比一次性解析慢数倍，此时与未安装ijson一样优先使用orjson一次性解析
+    """
+    try:
+        with open(input_file, 'rb') as f:
+            if ijson is not None and ijson.backend != 'python':
+                yield from ijson.items(f, 'item', use_float=True)
+            else:
+                yield from load_json(f.read())
+    except Exception as e:
+        logging.error("[-] 读取失败: %s", e)
+
 def format_timestamp(timestamp):
     """格式化时间戳"""
     try:
@@ -71,36 +114,23 @@ def extract_message_content(message):
     
     return ""
 
-def build_conversation_tree(mapping):
-    """构建对话树结构"""
-    # 找到根节点（parent为null的消息）
-    root_messages = []
-    message_nodes = {}
-    
-    for msg_id, msg_data in mapping.items():
-        if msg_data.get('parent') is None:
-            root_messages.append(msg_id)
-        message_nodes[msg_id] = msg_data
-    
-    conversations = []
-    
-    # 遍历每个根消息构建对话链
-    for root_id in root_messages:
-        conversation_chain = []
-        current_id = root_id
+def iter_conversation_nodes(mapping):
+    """按对话链顺序逐个返回消息节点"""
+    # 从每个根节点（parent为null的消息）出发遍历对话链
+    for root_id, root_data in mapping.items():
+        if root_data.get('parent') is not None:
+            continue
         
-        while current_id and current_id in message_nodes:
-            node = message_nodes[current_id]
-            conversation_chain.append(node)
+        current_id = root_id
+        while current_id:
+            node = mapping.get(current_id)
+            if node is None:
+                break
+            yield node
             
             # 移动到下一个消息（通常只有一个child）
-            children = node.get('children', [])
+            children = node.get('children')
             current_id = children[0] if children else None
-        
-        if conversation_chain:
-            conversations.append(conversation_chain)
-    
-    return conversations
 
 def parse_chatgpt_conversation(conversation_data, index):
     """解析单个ChatGPT会话"""
@@ -115,24 +145,26 @@ def parse_chatgpt_conversation(conversation_data, index):
         create_str = format_timestamp(create_time)
         update_str = format_timestamp(update_time)
         
-        # 构建对话树
-        conversation_chains = build_conversation_tree(mapping)
+        # 沿对话链遍历，直接提取消息
         messages = []
+        chain_count = 0
         
-        for chain in conversation_chains:
-            for node in chain:
-                message = node.get('message', {})
-                if message:
-                    author = message.get('author', {})
-                    role = author.get('role', 'unknown')
-                    content = extract_message_content(message)
-                    
-                    if content:  # 只有当有内容时才添加
-                        messages.append({
-                            'role': role,
-                            'content': content,
-                            'message_id': node.get('id', '')
-                        })
+        for node in iter_conversation_nodes(mapping):
+            if node.get('parent') is None:
+                chain_count += 1
+            
+            message = node.get('message', {})
+            if message:
+                author = message.get('author', {})
+                role = author.get('role', 'unknown')
+                content = extract_message_content(message)
+                
+                if content:  # 只有当有内容时才添加
+                    messages.append({
+                        'role': role,
+                        'content': content,
+                        'message_id': node.get('id', '')
+                    })
         
         return {
             'title': title,
@@ -141,81 +173,92 @@ def parse_chatgpt_conversation(conversation_data, index):
             'update_time': update_str,
             'message_count': len(messages),
             'messages': messages,
-            'chain_count': len(conversation_chains)
+            'chain_count': chain_count
         }
         
     except Exception as e:
         logging.error("[-] 解析会话 %d 时出错: %s", index, e)
         return None
 
-def convert_to_markdown(conversation_data):
-    """生成Markdown内容"""
+def role_display(role):
+    """获取角色显示名称"""
+    return ROLE_DISPLAY.get(role, f"❓ {role}")
+
+def write_markdown(write, conversation_data):
+    """将会话的Markdown内容逐条写出，不在内存中拼接整个文档"""
     if not conversation_data:
-        return "# 解析失败\n\n该会话数据格式异常"
-    
-    md_content = []
+        write("# 解析失败\n\n该会话数据格式异常")
+        return
     
     # 元数据头部
-    md_content.append(f"# {conversation_data['title']}\n")
-    md_content.append("## 会话信息\n")
-    md_content.append(f"- **ID**: `{conversation_data['id']}`")
-    md_content.append(f"- **创建时间**: {conversation_data['create_time']}")
-    md_content.append(f"- **更新时间**: {conversation_data['update_time']}")
-    md_content.append(f"- **消息数量**: {conversation_data['message_count']} 条")
-    md_content.append(f"- **对话链数量**: {conversation_data['chain_count']} 条\n")
-    
-    md_content.append("---\n")
+    write(
+        f"# {conversation_data['title']}\n\n"
+        "## 会话信息\n\n"
+        f"- **ID**: `{conversation_data['id']}`\n"
+        f"- **创建时间**: {conversation_data['create_time']}\n"
+        f"- **更新时间**: {conversation_data['update_time']}\n"
+        f"- **消息数量**: {conversation_data['message_count']} 条\n"
+        f"- **对话链数量**: {conversation_data['chain_count']} 条\n\n"
+        "---\n\n"
+    )
     
-    # 对话内容
+    # 对话内容，消息正文直接写出，不再拼接副本
     for i, message in enumerate(conversation_data['messages'], 1):
-        role_display = {
-            'user': '👤 用户',
-            'assistant': '🤖 ChatGPT',
-            'system': '⚙️ 系统',
-            'unknown': '❓ 未知'
-        }.get(message['role'], f"❓ {message['role']}")
-        
-        md_content.append(f"## {role_display} - 消息 {i}\n")
-        
+        write(f"## {role_display(message['role'])} - 消息 {i}\n\n")
         if message['content']:
-            md_content.append(message['content'] + "\n")
-        
-        md_content.append("---\n")
+            write(message['content'])
+            write("\n\n")
+        write("---\n\n")
     
     # 尾部信息
-    md_content.append(f"*导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*")
-    md_content.append("*使用ChatGPT导出工具生成*")
-    
-    return "\n".join(md_content)
+    write(
+        f"*导出时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*\n"
+        "*使用ChatGPT导出工具生成*"
+    )
+
+def open_unique_file(output_dir, safe_title, used_names):
+    """
+    以独占模式创建不重名的Markdown文件，返回(文件对象, 文件名)；
+    used_names为已占用文件名的casefold集合，磁盘上已有同名文件时继续编号，不会覆盖
+    """
+    filename = f"{safe_title}.md"
+    counter = 1
+    while True:
+        key = filename.casefold()
+        if key not in used_names:
+            try:
+                f = open(os.path.join(output_dir, filename), 'x', encoding='utf-8', buffering=1 << 20)
+                used_names.add(key)
+                return f, filename
+            except FileExistsError:
+                used_names.add(key)
+        filename = f"{safe_title}_{counter}.md"
+        counter += 1
 
 def process_chatgpt_export(input_file="conversations.json", output_dir="ChatGPT_Conversations"):
     """主处理函数"""
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
     
-    # 读取数据
-    try:
-        logging.info("[+] 读取文件: %s", input_file)
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        logging.info("[+] 成功读取 %d 个会话", len(data))
-    except Exception as e:
-        logging.error("[-] 读取失败: %s", e)
-        return
+    logging.info("[+] 读取文件: %s", input_file)
     
     # 处理统计
     stats = {
-        'total': len(data),
+        'total': 0,
         'success': 0,
         'failed': 0,
         'failed_indices': []
     }
     
+    # 已占用的文件名（casefold后比较，兼容不区分大小写的文件系统），只读取一次目录
+    used_names = {name.casefold() for name in os.listdir(output_dir)}
+    
     # 处理每个会话
-    for i, conversation in enumerate(data, 1):
+    for i, conversation in enumerate(iter_conversations(input_file), 1):
+        stats['total'] = i
         try:
             title = conversation.get('title', f'会话_{i}')
-            logging.info("[PROCESS] 处理 [%d/%d]: %s", i, stats['total'], title[:40])
+            logging.info("[PROCESS] 处理 [%d]: %s", i, title[:40])
             
             parsed_data = parse_chatgpt_conversation(conversation, i)
             if not parsed_data:
@@ -226,23 +269,19 @@ def process_chatgpt_export(input_file="conversations.json", output_dir="ChatGPT_
                 logging.warning("[WARN] 会话 %d 没有解析出任何消息内容", i)
                 # 但仍然继续处理，可能包含元数据信息
             
-            md_content = convert_to_markdown(parsed_data)
-            
             # 生成安全文件名
             safe_title = sanitize_filename(parsed_data['title'])
-            filename = f"{safe_title}.md"
+            f, filename = open_unique_file(output_dir, safe_title, used_names)
             filepath = os.path.join(output_dir, filename)
             
-            # 处理重复文件
-            counter = 1
-            while os.path.exists(filepath):
-                filename = f"{safe_title}_{counter}.md"
-                filepath = os.path.join(output_dir, filename)
-                counter += 1
-            
-            # 保存文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(md_content)
+            # 直接写入文件；生成失败时删除本次创建的不完整文件，并释放文件名
+            try:
+                with f:
+                    write_markdown(f.write, parsed_data)
+            except Exception:
+                os.remove(filepath)
+                used_names.discard(filename.casefold())
+                raise
             
             stats['success'] += 1
             logging.info("[SUCCESS] 保存成功: %s (消息数: %d)", filename, parsed_data['message_count'])
@@ -252,6 +291,8 @@ def process_chatgpt_export(input_file="conversations.json", output_dir="ChatGPT_
             stats['failed_indices'].append(i)
             logging.error("[-] 处理失败 [%d]: %s", i, e)
     
+    logging.info("[+] 共读取 %d 个会话", stats['total'])
+    
     # 生成报告
     generate_report(stats, output_dir)
 
@@ -292,11 +333,11 @@ def generate_report(stats, output_dir):
 def debug_first_conversation(input_file="conversations.json"):
     """调试第一个会话的数据结构"""
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        conversations = iter_conversations(input_file)
+        first_conv = next(conversations, None)
+        conversations.close()
         
-        if data:
-            first_conv = data[0]
+        if first_conv:
             print("=== 第一个会话的调试信息 ===")
             print(f"标题: {first_conv.get('title')}")
             print(f"ID: {first_conv.get('id')}")
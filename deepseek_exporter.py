@@ -1,13 +1,52 @@
 import json
 import os
 import re
+import sys
+import queue
+import logging
+import logging.handlers
 from datetime import datetime
 import shutil
+import traceback
 import collections
+from concurrent.futures import ProcessPoolExecutor
+
+# 可选依赖：orjson 用于快速解析导出文件
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('deepseek')
+# 子进程中产生的日志记录先暂存在这里，由主进程按对话顺序输出
+worker_log_records = queue.SimpleQueue()
+
+# 文件名非法字符和换行符
+INVALID_FILENAME_RE = re.compile(r'[<>:"/\\|?*\n\r\t]')
+# 锚点中不允许的字符
+INVALID_ANCHOR_RE = re.compile(r'[^\w\-_]')
+# 附件扩展名对应的代码块语言
+EXTENSION_MAP = {
+    'py': 'python', 'js': 'javascript', 'java': 'java',
+    'cpp': 'cpp', 'c': 'c', 'html': 'html', 'css': 'css',
+    'json': 'json', 'xml': 'xml', 'md': 'markdown',
+    'txt': 'text', 'log': 'text', 'csv': 'csv', 'sql': 'sql',
+    'sh': 'bash', 'bat': 'batch', 'yml': 'yaml', 'yaml': 'yaml',
+    'vb': 'vb.net'
+}
+
+def load_json(raw):
+    """解析DeepSeek的conversations.json；标题或片段中有孤立代理项时orjson会报错，改用json重新解析"""
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
 
 def sanitize_filename(title):
     """清理标题中的特殊字符，使其适合作为文件名"""
-    sanitized = re.sub(r'[<>:"/\\|?*]', '', title)
+    sanitized = INVALID_FILENAME_RE.sub('', title)
     if len(sanitized) > 100:
         sanitized = sanitized[:100]
     return sanitized.strip()
@@ -21,80 +60,93 @@ def parse_timestamp(timestamp_str):
     except:
         return datetime.now()
 
-def count_messages(mapping):
-    """计算对话中的消息数量"""
-    count = 0
-    for node_id, node in mapping.items():
-        if node_id != "root" and node.get("message") and node["message"].get("fragments"):
-            count += 1
-    return count
+def format_timestamp(timestamp_str):
+    """将时间戳格式化为 YYYY-MM-DD HH:MM:SS"""
+    # 导出文件中的时间戳已是 YYYY-MM-DDTHH:MM:SS... 格式，直接截取即可
+    if (isinstance(timestamp_str, str) and len(timestamp_str) >= 19
+            and timestamp_str[4] == '-' and timestamp_str[7] == '-' and timestamp_str[10] in 'T '
+            and timestamp_str[13] == ':' and timestamp_str[16] == ':'):
+        return timestamp_str[:10] + ' ' + timestamp_str[11:19]
+    return parse_timestamp(timestamp_str).strftime('%Y-%m-%d %H:%M:%S')
 
-def extract_message_content(message_node):
-    """从消息节点中提取用户提问和AI回复，忽略工具调用片段（TOOL_SEARCH, TOOL_OPEN等）"""
-    if not message_node or not message_node.get("fragments"):
-        return {"user_question": "", "ai_thoughts": [], "ai_responses": []}
-    
-    user_question = ""
-    ai_thoughts = []
-    ai_responses = []
-    
-    for fragment in message_node["fragments"]:
-        fragment_type = fragment.get("type", "")
-        content = fragment.get("content", "").strip()
-        
-        if fragment_type == "REQUEST":
-            user_question = content
-        elif fragment_type == "THINK":
-            if content:
-                ai_thoughts.append(content)
-        elif fragment_type == "RESPONSE":
-            if content:
-                ai_responses.append(content)
-        # 显式忽略工具调用类型的片段（无内容，无需处理）
-        elif fragment_type in ("TOOL_SEARCH", "TOOL_OPEN"):
-            # 直接跳过，不做任何处理
-            pass
-        # 其他未知类型也忽略（保持向后兼容）
-        # else: pass
-    
-    return {
-        "user_question": user_question,
-        "ai_thoughts": ai_thoughts,
-        "ai_responses": ai_responses
-    }
+def setup_logging(log_file, level=logging.INFO):
+    """设置日志：只输出消息本身，同时写入控制台和日志文件"""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    # 标题中可能有孤立的代理项（如被截断的emoji），以转义形式输出，避免整行日志丢失
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(errors='backslashreplace')
+    formatter = logging.Formatter('%(message)s')
+    file_handler = logging.FileHandler(log_file, encoding='utf-8', errors='backslashreplace')
+    for handler in (file_handler, logging.StreamHandler(sys.stdout)):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
 
-def build_conversation_flow(mapping, log_message=None):
-    """构建完整的对话流程，使用深度优先遍历"""
-    
-    # 如果没有提供日志函数，使用默认的空函数
-    if log_message is None:
-        def log_message(msg):
-            pass
+def init_worker(level):
+    """子进程的日志设置：记录放入队列，不直接输出"""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(worker_log_records))
+    logger.setLevel(level)
+    logger.propagate = False
+
+def build_conversation_flow(mapping):
+    """构建完整的对话流程，返回(对话流程, 消息数量)；消息数量为带片段的非根节点数"""
     
     conversation_flow = []
+    message_count = 0
     
-    # 收集所有有消息的节点
+    # 收集所有有消息的节点，一次遍历片段同时提取用户提问和AI回复
     for node_id, node in mapping.items():
-        if node_id != "root" and node.get("message") and node["message"].get("fragments"):
-            message_data = extract_message_content(node["message"])
+        message = node.get("message")
+        fragments = message.get("fragments") if message else None
+        if node_id != "root" and fragments:
+            message_count += 1
+            has_request = False
+            has_response = False
+            user_question = ""
+            ai_thoughts = []
+            ai_responses = []
             
-            has_request = any(frag.get("type") == "REQUEST" for frag in node["message"]["fragments"])
-            has_response = any(frag.get("type") in ["THINK", "RESPONSE"] for frag in node["message"]["fragments"])
+            for fragment in fragments:
+                fragment_type = fragment.get("type", "")
+                if fragment_type == "REQUEST":
+                    has_request = True
+                    user_question = fragment.get("content", "").strip()
+                elif fragment_type == "THINK":
+                    has_response = True
+                    content = fragment.get("content", "").strip()
+                    if content:
+                        ai_thoughts.append(content)
+                elif fragment_type == "RESPONSE":
+                    has_response = True
+                    content = fragment.get("content", "").strip()
+                    if content:
+                        ai_responses.append(content)
+                # 工具调用片段（TOOL_SEARCH, TOOL_OPEN等）及其他未知类型直接忽略
             
-            if has_request or has_response:
-                conversation_flow.append({
-                    "node": node,
-                    "message_data": message_data,
-                    "is_user": has_request,
-                    "is_ai": has_response
-                })
-    
-    log_message(f"    - 收集到 {len(conversation_flow)} 个有效节点")
+            if not (has_request or has_response):
+                continue
+            
+            conversation_flow.append({
+                "node": node,
+                "message_data": {
+                    "user_question": user_question,
+                    "ai_thoughts": ai_thoughts,
+                    "ai_responses": ai_responses
+                },
+                "is_user": has_request,
+                "is_ai": has_response
+            })
+    
+    logger.debug("    - 收集到 %d 个有效节点", len(conversation_flow))
     
     # 安全的排序逻辑
     def safe_sort_key(item):
         node_id = item['node']['id']
-        log_message(f"    - 排序处理节点ID: {node_id}, 类型: {type(node_id)}")
         
         if node_id is None:
             return (0, "")  # None 值排在前面
@@ -106,196 +158,156 @@ def build_conversation_flow(mapping, log_message=None):
             # 如果是字符串，确保不是 None
             return (2, str(node_id) if node_id is not None else "")
     
-    # 尝试排序
+    # 尝试排序；节点ID通常都是数字，先直接按整数排序，失败时再使用通用排序键
     try:
-        conversation_flow.sort(key=safe_sort_key)
-        log_message("    - 节点排序成功")
+        try:
+            conversation_flow.sort(key=lambda item: int(item['node']['id']))
+        except (ValueError, TypeError):
+            conversation_flow.sort(key=safe_sort_key)
+        logger.debug("    - 节点排序成功，共 %d 个节点", len(conversation_flow))
     except Exception as e:
-        log_message(f"    - 节点排序失败: {e}")
-        log_message("    - 使用默认顺序")
+        logger.warning("    - 节点排序失败: %s", e)
+        logger.warning("    - 使用默认顺序")
         # 保持原顺序
     
-    return conversation_flow
+    return conversation_flow, message_count
 
-def generate_markdown(conversation, output_dir, log_message=None):
-    """为单个对话生成Markdown文件"""
-    
-    if log_message is None:
-        def log_message(msg):
+def create_anchor(node_id):
+    """将节点ID转换为Markdown锚点"""
+    return INVALID_ANCHOR_RE.sub('-', node_id)
+
+def write_search_results(write_line, fragments, with_link):
+    """写出消息片段中的搜索结果（仅旧格式）；with_link为True时标题带链接、摘要单行显示"""
+    search_results = []
+    for fragment in fragments:
+        if fragment.get("type") == "SEARCH" and fragment.get("results"):
+            search_results = fragment["results"]
+            break
+    if not search_results:
+        return
+    
+    write_line(f"\n**🌐 网页**(共 {len(search_results)} 个):")
+    if len(search_results) > 1:
+        try:
+            search_results.sort(key=lambda x: x.get("cite_index", 0) or 0)
+        except:
             pass
+    for result in search_results:
+        published_at = result.get("published_at")
+        if published_at:
+            try:
+                date_str = datetime.fromtimestamp(published_at).strftime('%Y-%m-%d')
+            except:
+                date_str = "未知日期"
+        else:
+            date_str = "未知日期"
+        site_name = result.get("site_name", "未知网站")
+        title_tmp = result.get("title", "无标题")
+        url = result.get("url", "")
+        snippet = result.get("snippet", "")
+        write_line(f"> **网站**: {site_name} `{date_str}`")
+        if with_link:
+            if url:
+                write_line(f"> **标题**: [{title_tmp}]({url})")
+            else:
+                write_line(f"> **标题**: {title_tmp}")
+            if snippet:
+                write_line(f"> **摘要**: `{snippet}`")
+            write_line("\n")
+        else:
+            write_line(f"> **标题**: {title_tmp}")
+            if url:
+                write_line(f"> **网址**: `{url}`")
+            if snippet:
+                write_line("> **摘要**:")
+                for line in snippet.split('\n'):
+                    if line.strip():
+                        write_line(f">> {line}")
+            write_line(">")
+
+def write_node_relations(write_line, node):
+    """写出节点的父子关系链接"""
+    parent_id = node.get('parent')
+    children_ids = node.get('children', [])
+    if not (parent_id or children_ids):
+        return
+    
+    relation_parts = []
+    if parent_id and parent_id != "root":
+        relation_parts.append(f"父节点: [{parent_id}](#{create_anchor(parent_id)})")
+    elif parent_id == "root":
+        relation_parts.append(f"父节点: {parent_id}")
+    if children_ids:
+        children_links = [f"[{cid}](#{create_anchor(cid)})" for cid in children_ids]
+        relation_parts.append(f"子节点: {', '.join(children_links)}")
+    write_line(f"\n**🔗 节点关系:** { ' | '.join(relation_parts) }")
+
+def write_markdown(write, conversation, conversation_flow, message_count):
+    """将对话的Markdown内容逐段写出，不在内存中拼接整个文档"""
     
-    def create_anchor(node_id):
-        anchor = re.sub(r'[^\w\-_]', '-', node_id)
-        return anchor
+    def write_line(text):
+        write(text)
+        write("\n")
     
     title = conversation.get("title", "未命名对话")
     conversation_id = conversation.get("id", "未知ID")
     inserted_at = conversation.get("inserted_at", "")
     updated_at = conversation.get("updated_at", "")
-    mapping = conversation.get("mapping", {})
-    
-    log_message(f"  - 开始处理对话 '{title}'")
-    log_message(f"  - 对话ID: {conversation_id}")
-    log_message(f"  - 映射节点数量: {len(mapping)}")
     
-    message_count = count_messages(mapping)
-    log_message(f"  - 有效消息数量: {message_count}")
+    write_line(f"# 💬 {title}\n")
+    write_line("## 📋 会话信息\n")
+    write_line(f"- **🗂️ ID**: `{conversation_id}`")
+    write_line(f"- **🕐 创建时间**: {format_timestamp(inserted_at)}")
+    write_line(f"- **🔄 更新时间**: {format_timestamp(updated_at)}")
+    write_line(f"- **💭 消息数量**: {message_count} 条\n")
+    write_line("---\n")
     
-    safe_title = sanitize_filename(title)
-    filename = f"{safe_title}.md"
-    filepath = os.path.join(output_dir, filename)
-    
-    counter = 1
-    original_filepath = filepath
-    while os.path.exists(filepath):
-        name, ext = os.path.splitext(original_filepath)
-        filepath = f"{name}_{counter}{ext}"
-        counter += 1
-    
-    log_message(f"  - 开始构建对话流程")
-    conversation_flow = build_conversation_flow(mapping, log_message)
-    log_message(f"  - 对话流程构建完成，共 {len(conversation_flow)} 个节点")
-    
-    md_content = []
-    md_content.append(f"# 💬 {title}\n")
-    md_content.append("## 📋 会话信息\n")
-    md_content.append(f"- **🗂️ ID**: `{conversation_id}`")
-    md_content.append(f"- **🕐 创建时间**: {parse_timestamp(inserted_at).strftime('%Y-%m-%d %H:%M:%S')}")
-    md_content.append(f"- **🔄 更新时间**: {parse_timestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S')}")
-    md_content.append(f"- **💭 消息数量**: {message_count} 条\n")
-    md_content.append("---\n")
-    
-    log_message(f"  - 开始生成Markdown内容")
+    logger.debug("  - 开始生成Markdown内容")
     for i, item in enumerate(conversation_flow):
         node = item["node"]
         message_data = item["message_data"]
-        timestamp = parse_timestamp(node['message']['inserted_at']).strftime('%Y-%m-%d %H:%M:%S')
-        model = node.get("message", {}).get("model", "未知模型")
+        message = node["message"]
+        timestamp = format_timestamp(message['inserted_at'])
         
         # 用户提问
         if item["is_user"] and message_data["user_question"]:
-            md_content.append(f"\n## 👤 用户")
-            md_content.append(f"{message_data['user_question']}\n")
+            write_line(f"\n## 👤 用户")
+            write_line(f"{message_data['user_question']}\n")
             
             # 搜索信息（仅旧格式）
-            search_results = []
-            for fragment in node.get("message", {}).get("fragments", []):
-                if fragment.get("type") == "SEARCH" and fragment.get("results"):
-                    search_results = fragment["results"]
-                    break
-            if search_results:
-                md_content.append(f"\n**🌐 网页**(共 {len(search_results)} 个):")
-                try:
-                    search_results.sort(key=lambda x: x.get("cite_index", 0) or 0)
-                except:
-                    pass
-                for result in search_results:
-                    published_at = result.get("published_at")
-                    if published_at:
-                        try:
-                            date_str = datetime.fromtimestamp(published_at).strftime('%Y-%m-%d')
-                        except:
-                            date_str = "未知日期"
-                    else:
-                        date_str = "未知日期"
-                    site_name = result.get("site_name", "未知网站")
-                    title_tmp = result.get("title", "无标题")
-                    url = result.get("url", "")
-                    snippet = result.get("snippet", "")
-                    md_content.append("> **网站**: " + site_name + f" `{date_str}`")
-                    md_content.append("> **标题**: " + title_tmp)
-                    if url:
-                        md_content.append("> **网址**: `" + url + "`")
-                    if snippet:
-                        md_content.append("> **摘要**:")
-                        snippet_lines = snippet.split('\n')
-                        for line in snippet_lines:
-                            if line.strip():
-                                md_content.append(">> " + line)
-                    md_content.append(">")
+            write_search_results(write_line, message["fragments"], with_link=False)
             
             # 附件
-            files = node.get("message", {}).get("files", [])
+            files = message.get("files", [])
             if files:
-                md_content.append("\n**📎 附件**:")
+                write_line("\n**📎 附件**:")
                 for file_info in files:
                     file_id = file_info.get('id', '未知ID')
                     file_name = file_info.get('file_name', '未知文件名')
                     file_content = file_info.get('content', '')
-                    md_content.append("> 🆔 **文件ID**: `" + file_id + "`")
-                    md_content.append("> 📄 **文件名**: `" + file_name + "`")
+                    write_line(f"> 🆔 **文件ID**: `{file_id}`")
+                    write_line(f"> 📄 **文件名**: `{file_name}`")
                     if file_content:
-                        md_content.append("> 📋 **文件内容**:")
+                        write_line("> 📋 **文件内容**:")
                         file_extension = os.path.splitext(file_name)[1].lower().lstrip('.')
-                        ext_map = {
-                            'py': 'python', 'js': 'javascript', 'java': 'java',
-                            'cpp': 'cpp', 'c': 'c', 'html': 'html', 'css': 'css',
-                            'json': 'json', 'xml': 'xml', 'md': 'markdown',
-                            'txt': 'text', 'log': 'text', 'csv': 'csv', 'sql': 'sql',
-                            'sh': 'bash', 'bat': 'batch', 'yml': 'yaml', 'yaml': 'yaml',
-                            'vb': 'vb.net'
-                        }
-                        code_lang = ext_map.get(file_extension, 'text')
-                        md_content.append(f"> ```{code_lang}")
+                        code_lang = EXTENSION_MAP.get(file_extension, 'text')
+                        write_line(f"> ```{code_lang}")
                         normalized_content = file_content.replace('\r\n', '\n').replace('\r', '\n')
-                        for line in normalized_content.split('\n'):
-                            md_content.append("> " + line)
-                        md_content.append("> ```")
+                        # 每行加引用前缀，一次替换完成
+                        write_line("> " + normalized_content.replace('\n', '\n> '))
+                        write_line("> ```")
             
-            md_content.append(f"\n*🆔 {node['id']} | 🕐 {timestamp}*")
+            write_line(f"\n*🆔 {node['id']} | 🕐 {timestamp}*")
             
-            parent_id = node.get('parent')
-            children_ids = node.get('children', [])
-            if parent_id or children_ids:
-                relation_parts = []
-                if parent_id and parent_id != "root":
-                    parent_anchor = create_anchor(parent_id)
-                    relation_parts.append(f"父节点: [{parent_id}](#{parent_anchor})")
-                elif parent_id == "root":
-                    relation_parts.append(f"父节点: {parent_id}")
-                if children_ids:
-                    children_links = [f"[{cid}](#{create_anchor(cid)})" for cid in children_ids]
-                    relation_parts.append(f"子节点: {', '.join(children_links)}")
-                md_content.append(f"\n**🔗 节点关系:** { ' | '.join(relation_parts) }")
-            md_content.append("\n---\n")
+            write_node_relations(write_line, node)
+            write_line("\n---\n")
         
         # AI回复部分（修改重点）
         if item["is_ai"] and (message_data["ai_thoughts"] or message_data["ai_responses"]):
-            md_content.append(f"\n## 🤖 回复")
+            write_line(f"\n## 🤖 回复")
             
             # 搜索信息（仅旧格式）
-            search_results = []
-            for fragment in node.get("message", {}).get("fragments", []):
-                if fragment.get("type") == "SEARCH" and fragment.get("results"):
-                    search_results = fragment["results"]
-                    break
-            if search_results:
-                md_content.append(f"\n**🌐 网页**(共 {len(search_results)} 个):")
-                try:
-                    search_results.sort(key=lambda x: x.get("cite_index", 0) or 0)
-                except:
-                    pass
-                for result in search_results:
-                    published_at = result.get("published_at")
-                    if published_at:
-                        try:
-                            date_str = datetime.fromtimestamp(published_at).strftime('%Y-%m-%d')
-                        except:
-                            date_str = "未知日期"
-                    else:
-                        date_str = "未知日期"
-                    site_name = result.get("site_name", "未知网站")
-                    title_tmp = result.get("title", "无标题")
-                    url = result.get("url", "")
-                    snippet = result.get("snippet", "")
-                    md_content.append("> **网站**: " + site_name + f" `{date_str}`")
-                    if url:
-                        md_content.append("> **标题**: [" + title_tmp + "](" + url + ")")
-                    else:
-                        md_content.append("> **标题**: " + title_tmp)
-                    if snippet:
-                        md_content.append("> **摘要**: `" + snippet + "`")
-                    md_content.append("\n")
+            write_search_results(write_line, message["fragments"], with_link=True)
             
             # ========== 核心修改：合并所有思考内容，然后输出回复 ==========
             thoughts = message_data["ai_thoughts"]
@@ -303,44 +315,72 @@ def generate_markdown(conversation, output_dir, log_message=None):
             
             # 输出所有思考内容（合并为一个连续引用块）
             if thoughts:
-                md_content.append(f"\n**💭 思考**：")
+                write_line(f"\n**💭 思考**：")
                 for idx, thought in enumerate(thoughts):
                     if idx > 0:
-                        md_content.append("")  # 思考片段之间空行（保持引用块连续性）
-                    thought_lines = thought.split('\n')
-                    for line in thought_lines:
-                        md_content.append("> " + line)
-                md_content.append("")  # 思考结束后空一行（退出引用块）
+                        write_line("")  # 思考片段之间空行（保持引用块连续性）
+                    write_line("> " + thought.replace('\n', '\n> '))
+                write_line("")  # 思考结束后空一行（退出引用块）
             
             # 输出所有回复内容（通常只有一个 RESPONSE）
             if responses:
                 for response in responses:
-                    md_content.append(f"{response}\n")
+                    write_line(f"{response}\n")
             # ============================================================
             
-            model = node.get("message", {}).get("model", "未知模型")
-            md_content.append(f"\n*🆔 {node['id']} | 🧠 {model} | 🕐 {timestamp}*")
+            model = message.get("model", "未知模型")
+            write_line(f"\n*🆔 {node['id']} | 🧠 {model} | 🕐 {timestamp}*")
             
-            parent_id = node.get('parent')
-            children_ids = node.get('children', [])
-            if parent_id or children_ids:
-                relation_parts = []
-                if parent_id and parent_id != "root":
-                    parent_anchor = create_anchor(parent_id)
-                    relation_parts.append(f"父节点: [{parent_id}](#{parent_anchor})")
-                elif parent_id == "root":
-                    relation_parts.append(f"父节点: {parent_id}")
-                if children_ids:
-                    children_links = [f"[{cid}](#{create_anchor(cid)})" for cid in children_ids]
-                    relation_parts.append(f"子节点: {', '.join(children_links)}")
-                md_content.append(f"\n**🔗 节点关系:** { ' | '.join(relation_parts) }")
-            md_content.append("\n---\n")
+            write_node_relations(write_line, node)
+            write_line("\n---\n")
+    
+    write_line(f"*📄 Markdown文件生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*")
+    write("*使用DeepSeek导出工具生成*\n")
+
+def unique_filepath(title, output_dir, used_names=None):
+    """为标题分配输出目录中不重复的文件路径，used_names为已占用文件名的casefold集合"""
+    # 已占用的文件名，未提供时读取一次输出目录；casefold后比较，兼容不区分大小写的文件系统
+    if used_names is None:
+        used_names = {name.casefold() for name in os.listdir(output_dir)}
+    
+    safe_title = sanitize_filename(title)
+    filename = f"{safe_title}.md"
+    
+    counter = 1
+    while filename.casefold() in used_names:
+        filename = f"{safe_title}_{counter}.md"
+        counter += 1
+    used_names.add(filename.casefold())
+    return os.path.join(output_dir, filename)
+
+def generate_markdown(conversation, output_dir, used_names=None, filepath=None):
+    """为单个对话生成Markdown文件，filepath未指定时根据标题分配不重复的文件名"""
     
-    md_content.append(f"*📄 Markdown文件生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*")
-    md_content.append("*使用DeepSeek导出工具生成*\n")
+    title = conversation.get("title", "未命名对话")
+    conversation_id = conversation.get("id", "未知ID")
+    inserted_at = conversation.get("inserted_at", "")
+    mapping = conversation.get("mapping", {})
+    
+    logger.debug("  - 开始处理对话 '%s'", title)
+    logger.debug("  - 对话ID: %s", conversation_id)
+    logger.debug("  - 映射节点数量: %d", len(mapping))
     
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(md_content))
+    if filepath is None:
+        filepath = unique_filepath(title, output_dir, used_names)
+    
+    logger.debug("  - 开始构建对话流程")
+    conversation_flow, message_count = build_conversation_flow(mapping)
+    logger.debug("  - 有效消息数量: %d", message_count)
+    logger.debug("  - 对话流程构建完成，共 %d 个节点", len(conversation_flow))
+    
+    # 以独占模式直接写入文件，绝不覆盖已有文件；生成失败时只删除本次创建的不完整文件
+    f = open(filepath, 'x', encoding='utf-8', buffering=1 << 20)
+    try:
+        with f:
+            write_markdown(f.write, conversation, conversation_flow, message_count)
+    except Exception:
+        os.remove(filepath)
+        raise
     
     try:
         creation_time = parse_timestamp(inserted_at).timestamp()
@@ -348,11 +388,48 @@ def generate_markdown(conversation, output_dir, log_message=None):
     except:
         pass
     
-    log_message(f"  - 完成生成Markdown文件: {os.path.basename(filepath)}")
+    logger.debug("  - 完成生成Markdown文件: %s", os.path.basename(filepath))
     return filepath
 
-def json_to_markdown_converter(json_file_path):
-    """主转换函数"""
+def log_conversion_failure(conversation, i, message, error_details):
+    """记录单个对话的转换失败信息和错误堆栈"""
+    logger.error("❌ 转换失败 - %s: %s", conversation.get('title', f'对话_{i+1}'), message)
+    logger.error("错误详情:")
+    for line in error_details.split('\n'):
+        if line.strip():
+            logger.error("  %s", line)
+
+def convert_conversation(task):
+    """在子进程中转换单个对话，返回(是否成功, 日志记录列表)；filepath_error为主进程分配文件名时的错误"""
+    i, total_conversations, conversation, filepath, filepath_error = task
+    success = False
+    try:
+        if isinstance(conversation, str) and conversation.startswith("...<"):
+            logger.info("📝 注意: 检测到截断信息: %s", conversation)
+        else:
+            title = conversation.get("title", f"对话_{i+1}")
+            
+            logger.info("正在处理对话 %d/%d: %s", i + 1, total_conversations, title)
+            logger.info("对话ID: %s", conversation.get('id'))
+            
+            if filepath_error is not None:
+                log_conversion_failure(conversation, i, *filepath_error)
+            else:
+                filepath = generate_markdown(conversation, os.path.dirname(filepath), filepath=filepath)
+                
+                logger.info("✅ 成功转换: %s -> %s", title, os.path.basename(filepath))
+                success = True
+        
+    except Exception as e:
+        log_conversion_failure(conversation, i, str(e), traceback.format_exc())
+    
+    records = []
+    while not worker_log_records.empty():
+        records.append(worker_log_records.get())
+    return success, records
+
+def json_to_markdown_converter(json_file_path, workers=None, log_level=logging.INFO):
+    """主转换函数，workers为并行转换的进程数（默认由进程池决定，即CPU核心数，Windows上最多61），log_level设为logging.DEBUG可输出每个对话的处理细节"""
     
     # 创建输出目录
     output_dir = "output"
@@ -362,79 +439,69 @@ def json_to_markdown_converter(json_file_path):
     
     # 创建日志文件
     log_file = f"conversion_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-    log_content = []
+    setup_logging(log_file, log_level)
     
-    def log_message(message):
-        """将消息同时输出到控制台和日志内容"""
-        print(message)
-        log_content.append(message)
-    
-    log_message(f"DeepSeek JSON 转 Markdown 转换日志")
-    log_message(f"转换时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    log_message(f"输入文件: {json_file_path}")
-    log_message(f"输出目录: {output_dir}")
-    log_message("=" * 50)
+    logger.info("DeepSeek JSON 转 Markdown 转换日志")
+    logger.info("转换时间: %s", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    logger.info("输入文件: %s", json_file_path)
+    logger.info("输出目录: %s", output_dir)
+    logger.info("=" * 50)
     
     try:
         # 读取JSON文件
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(json_file_path, 'rb') as f:
+            raw = f.read()
+        data = load_json(raw)
         
         if not isinstance(data, list):
-            log_message("❌ 错误: JSON数据应该是一个数组")
+            logger.error("❌ 错误: JSON数据应该是一个数组")
             return False
         
-        # 处理每个对话
+        # 文件名按原顺序在主进程中分配，保证重名时的编号与串行处理一致；
+        # 输出目录是新建的，已占用的文件名只需在内存中记录
+        used_names = set()
         successful_conversions = 0
         total_conversations = len(data)
         
+        tasks = []
         for i, conversation in enumerate(data):
-            try:
-                if isinstance(conversation, str) and conversation.startswith("...<"):
-                    log_message(f"📝 注意: 检测到截断信息: {conversation}")
-                    continue
-                
-                title = conversation.get("title", f"对话_{i+1}")
-                
-                log_message(f"正在处理对话 {i+1}/{total_conversations}: {title}")
-                log_message(f"对话ID: {conversation.get('id')}")
-                
-                filepath = generate_markdown(conversation, output_dir, log_message)
-                
-                log_message(f"✅ 成功转换: {title} -> {os.path.basename(filepath)}")
-                successful_conversions += 1
-                
-            except Exception as e:
-                import traceback
-                error_details = traceback.format_exc()
-                log_message(f"❌ 转换失败 - {conversation.get('title', f'对话_{i+1}')}: {str(e)}")
-                log_message(f"错误详情:")
-                for line in error_details.split('\n'):
-                    if line.strip():
-                        log_message(f"  {line}")
+            filepath = filepath_error = None
+            if isinstance(conversation, dict):
+                # 标题异常（如为null）时只让该对话失败，且不占用文件名
+                try:
+                    filepath = unique_filepath(conversation.get("title", "未命名对话"), output_dir, used_names)
+                except Exception as e:
+                    filepath_error = (str(e), traceback.format_exc())
+            tasks.append((i, total_conversations, conversation, filepath, filepath_error))
+        
+        # 各对话互不依赖，分发到多个进程生成；日志按原顺序回放
+        # 未指定进程数时由进程池自行决定（Windows上不能超过61）
+        with ProcessPoolExecutor(max_workers=workers or None, initializer=init_worker,
+                                 initargs=(logger.getEffectiveLevel(),)) as executor:
+            chunksize = max(1, min(16, -(-len(tasks) // (executor._max_workers * 4))))
+            for success, records in executor.map(convert_conversation, tasks, chunksize=chunksize):
+                for record in records:
+                    logger.handle(record)
+                if success:
+                    successful_conversions += 1
         
         # 生成总结
-        log_message("=" * 50)
-        log_message(f"📊 转换总结:")
-        log_message(f"   总对话数: {total_conversations}")
-        log_message(f"   成功转换: {successful_conversions}")
-        log_message(f"   失败数: {total_conversations - successful_conversions}")
-        log_message(f"   输出目录: {os.path.abspath(output_dir)}")
+        logger.info("=" * 50)
+        logger.info("📊 转换总结:")
+        logger.info("   总对话数: %d", total_conversations)
+        logger.info("   成功转换: %d", successful_conversions)
+        logger.info("   失败数: %d", total_conversations - successful_conversions)
+        logger.info("   输出目录: %s", os.path.abspath(output_dir))
         
     except Exception as e:
-        import traceback
         error_details = traceback.format_exc()
-        log_message(f"❌ 致命错误: {str(e)}")
-        log_message(f"错误堆栈:")
+        logger.error("❌ 致命错误: %s", e)
+        logger.error("错误堆栈:")
         for line in error_details.split('\n'):
             if line.strip():
-                log_message(f"  {line}")
+                logger.error("  %s", line)
         return False
     
-    # 写入日志文件
-    with open(log_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(log_content))
-    
     print(f"转换完成！")
     print(f"日志文件: {log_file}")
     print(f"输出目录: {output_dir}")